@@ -1,10 +1,14 @@
 import os
 from flask import Flask
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET', 'dev-secret-key')
     app.config['DATABASE'] = os.path.join(app.instance_path, 'library.db')
+    # сколько секунд рецензия закреплена за модератором, взявшим её в работу
+    app.config['MODERATION_LEASE_SECONDS'] = int(os.environ.get('MODERATION_LEASE_SECONDS', '600'))
+    if test_config is not None:
+        app.config.update(test_config)
 
     # ensure instance folder exists
     os.makedirs(app.instance_path, exist_ok=True)
@@ -21,4 +25,12 @@ def create_app():
     from . import books
     app.register_blueprint(books.bp)
 
+    # CLI: flask build-recommendations (предрасчёт «похожих книг»)
+    from . import recommendations
+    recommendations.init_app(app)
+
+    # CLI: flask scan-covers (проверка md5 обложек и поиск файлов-«сирот»)
+    from . import covers
+    covers.init_app(app)
+
     return app
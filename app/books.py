@@ -2,9 +2,13 @@ import os
 import math
 import hashlib
 from werkzeug.utils import secure_filename
-from flask import Blueprint, render_template, request, current_app, g, url_for, redirect, flash
+from flask import Blueprint, render_template, stream_template, request, current_app, g, url_for, redirect, flash, get_flashed_messages
 from .db import get_db
 from .auth import login_required, roles_required
+from .search import search_books
+from . import moderation
+from .recommendations import get_similar_books
+from .covers import file_md5, ALLOWED_EXT
 
 # внешние библиотеки для Markdown + санитайза
 import markdown
@@ -12,7 +16,9 @@ import bleach
 
 bp = Blueprint('books', __name__)
 
-ALLOWED_EXT = {'png', 'jpg', 'jpeg', 'gif'}
+MY_REVIEWS_PER_PAGE = 20
+# размер страницы очереди модерации и пачки «Взять в работу»
+MODERATION_PER_PAGE = 10
 
 
 def allowed_filename(filename):
@@ -36,11 +42,7 @@ def save_cover_file(uploaded_file):
     path = os.path.join(static_folder, filename)
     uploaded_file.save(path)
 
-    md5 = hashlib.md5()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            md5.update(chunk)
-    md5_hex = md5.hexdigest()
+    md5_hex = file_md5(path)
     mime = uploaded_file.mimetype or 'application/octet-stream'
     return filename, mime, md5_hex
 
@@ -89,89 +91,6 @@ def get_search_filters():
     }
 
 
-def build_search_query(filters, page, per_page):
-    """Построить SQL запрос с фильтрами"""
-    where_conditions = []
-    params = []
-
-    # Фильтр по названию (частичное совпадение)
-    if filters['title']:
-        where_conditions.append("b.title LIKE ?")
-        params.append(f"%{filters['title']}%")
-
-    # Фильтр по автору (частичное совпадение)
-    if filters['author']:
-        where_conditions.append("b.author LIKE ?")
-        params.append(f"%{filters['author']}%")
-
-    # Фильтр по жанрам
-    if filters['genres']:
-        placeholders = ','.join(['?'] * len(filters['genres']))
-        where_conditions.append(f"g.id IN ({placeholders})")
-        params.extend(filters['genres'])
-
-    # Фильтр по годам
-    if filters['years']:
-        placeholders = ','.join(['?'] * len(filters['years']))
-        where_conditions.append(f"b.year IN ({placeholders})")
-        params.extend(filters['years'])
-
-    # Фильтр по объёму страниц
-    if filters['pages_min']:
-        try:
-            where_conditions.append("b.pages >= ?")
-            params.append(int(filters['pages_min']))
-        except ValueError:
-            pass
-
-    if filters['pages_max']:
-        try:
-            where_conditions.append("b.pages <= ?")
-            params.append(int(filters['pages_max']))
-        except ValueError:
-            pass
-
-    # Базовый запрос
-    where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-
-    # Запрос для подсчёта общего количества
-    count_query = f"""
-    SELECT COUNT(DISTINCT b.id) as cnt 
-    FROM books b
-    LEFT JOIN book_genres bg ON bg.book_id = b.id
-    LEFT JOIN genres g ON g.id = bg.genre_id
-    {where_clause}
-    """
-
-    # Основной запрос
-    offset = (page - 1) * per_page
-    main_query = f"""
-    SELECT b.id, b.title, b.year, b.author, b.pages,
-           REPLACE(GROUP_CONCAT(DISTINCT g.name), ',', ', ') as genres,
-           COALESCE(ar.avg_rating, 0) as avg_rating,
-           COALESCE(rc.cnt, 0) as review_count,
-           c.filename as cover
-    FROM books b
-    LEFT JOIN book_genres bg ON bg.book_id = b.id
-    LEFT JOIN genres g ON g.id = bg.genre_id
-    LEFT JOIN (
-        SELECT book_id, ROUND(AVG(rating), 2) as avg_rating FROM reviews GROUP BY book_id
-    ) ar ON ar.book_id = b.id
-    LEFT JOIN (
-        SELECT book_id, COUNT(*) as cnt FROM reviews GROUP BY book_id
-    ) rc ON rc.book_id = b.id
-    LEFT JOIN covers c ON c.book_id = b.id
-    {where_clause}
-    GROUP BY b.id
-    ORDER BY b.year DESC, b.id DESC
-    LIMIT ? OFFSET ?
-    """
-
-    params.extend([per_page, offset])
-
-    return count_query, main_query, params
-
-
 # --- Список книг с поиском ---
 @bp.route('/')
 def index():
@@ -192,17 +111,13 @@ def index():
     # Получить все жанры
     genres_all = db.execute('SELECT id, name FROM genres ORDER BY name').fetchall()
 
-    # Построить запрос с фильтрами
-    count_query, main_query, params = build_search_query(filters, page, per_page)
-
-    # Выполнить запросы
-    total = db.execute(count_query, params[:-2]).fetchone()['cnt']  # Исключаем LIMIT/OFFSET параметры
+    # Поиск: сначала id книг страницы, затем жанры/обложки/статистика только для них
+    total, books = search_books(db, filters, page, per_page)
     total_pages = math.ceil(total / per_page) if total > 0 else 1
 
-    books = db.execute(main_query, params).fetchall()
-
     return render_template('index.html',
                            books=books,
+                           total=total,
                            page=page,
                            total_pages=total_pages,
                            filters=filters,
@@ -233,29 +148,30 @@ def book_view(book_id):
     current_user_id = g.user['id'] if g.get('user') else None
 
     # 1) Получаем одобренные рецензии (видимые всем), но исключаем рецензию текущего пользователя
-    approved_rows = db.execute(
-        "SELECT r.id, r.user_id, r.rating, r.text, r.created_at, u.username, u.last_name, u.first_name "
-        "FROM reviews r "
-        "JOIN review_statuses rs ON r.status_id = rs.id "
-        "JOIN users u ON r.user_id = u.id "
-        "WHERE r.book_id = ? AND rs.name = 'одобрена' "
-        "ORDER BY r.created_at DESC",
-        (book_id,)
-    ).fetchall()
-
-    approved_reviews = []
-    for r in approved_rows:
-        # исключаем собственную рецензию, чтобы не дублировать
-        if current_user_id is not None and r['user_id'] == current_user_id:
-            continue
-        approved_reviews.append({
-            'id': r['id'],
-            'rating': r['rating'],
-            'created_at': r['created_at'],
-            'username': r['username'],
-            'name': ' '.join(filter(None, [r['last_name'], r['first_name']])),
-            'html': render_review_text(r['text'])
-        })
+    def iter_approved_reviews():
+        # запрос выполняется при стриминге страницы (соединение view к этому моменту
+        # уже закрыто teardown-ом); курсор не материализуется, рецензии рендерятся по одной
+        approved_rows = get_db().execute(
+            "SELECT r.id, r.user_id, r.rating, r.text, r.created_at, u.username, u.last_name, u.first_name "
+            "FROM reviews r "
+            "JOIN review_statuses rs ON r.status_id = rs.id "
+            "JOIN users u ON r.user_id = u.id "
+            "WHERE r.book_id = ? AND rs.name = 'одобрена' "
+            "ORDER BY r.created_at DESC",
+            (book_id,)
+        )
+        for r in approved_rows:
+            # исключаем собственную рецензию, чтобы не дублировать
+            if current_user_id is not None and r['user_id'] == current_user_id:
+                continue
+            yield {
+                'id': r['id'],
+                'rating': r['rating'],
+                'created_at': r['created_at'],
+                'username': r['username'],
+                'name': ' '.join(filter(None, [r['last_name'], r['first_name']])),
+                'html': render_review_text(r['text'])
+            }
 
     # 2) Если пользователь залогинен — получаем его собственную рецензию (любого статуса)
     user_review = None
@@ -275,7 +191,14 @@ def book_view(book_id):
                 'html': render_review_text(ur['text'])
             }
 
-    return render_template('book.html', book=book, user_review=user_review, reviews=approved_reviews)
+    # 3) Похожие книги — предрасчитаны командой flask build-recommendations
+    similar = get_similar_books(db, book_id)
+
+    # flash-сообщения забираются до стриминга: cookie сессии уходит вместе с заголовками
+    flashes = get_flashed_messages(with_categories=True)
+
+    return stream_template('book.html', book=book, user_review=user_review, reviews=iter_approved_reviews(),
+                           similar=similar, flashes=flashes)
 
 
 # --- Удаление книги (без изменений) ---
@@ -466,31 +389,68 @@ def book_review_add(book_id):
 @bp.route('/reviews/my')
 @login_required
 def my_reviews():
+    """Рецензии пользователя.
+
+    Без параметров — вся история, отдаётся потоком по мере чтения курсора;
+    с ?paged=1 / ?before=<id> — постранично по MY_REVIEWS_PER_PAGE, keyset по
+    (created_at, id): страница читается диапазоном idx_reviews_user_created,
+    без пропуска строк через OFFSET.
+    """
     db = get_db()
     uid = g.user['id']
-    rows = db.execute(
+    query = (
         "SELECT r.id, r.rating, r.text, r.created_at, rs.name as status_name, b.id as book_id, b.title as book_title "
         "FROM reviews r "
         "JOIN review_statuses rs ON r.status_id = rs.id "
         "JOIN books b ON r.book_id = b.id "
         "WHERE r.user_id = ? "
-        "ORDER BY r.created_at DESC",
-        (uid,)
-    ).fetchall()
-
-    reviews = []
-    for r in rows:
-        reviews.append({
-            'id': r['id'],
-            'rating': r['rating'],
-            'created_at': r['created_at'],
-            'status': r['status_name'],
-            'book_id': r['book_id'],
-            'book_title': r['book_title'],
-            'html': render_review_text(r['text'])
-        })
+    )
+    order = "ORDER BY r.created_at DESC, r.id DESC"
+
+    before = request.args.get('before', type=int)
+    paged = before is not None or bool(request.args.get('paged'))
+    next_before = None
+    rows = None
+    if paged:
+        per_page = MY_REVIEWS_PER_PAGE
+        params = [uid]
+        cursor_row = None
+        if before is not None:
+            cursor_row = db.execute(
+                'SELECT created_at, id FROM reviews WHERE id = ? AND user_id = ?', (before, uid)
+            ).fetchone()
+        page_query = query
+        if cursor_row is not None:
+            page_query += "AND (r.created_at, r.id) < (?, ?) "
+            params += [cursor_row['created_at'], cursor_row['id']]
+        # на одну строку больше — чтобы узнать о следующей странице без COUNT(*)
+        rows = db.execute(page_query + order + " LIMIT ?", (*params, per_page + 1)).fetchall()
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_before = rows[-1]['id']
+
+    # flash-сообщения забираются до стриминга: cookie сессии уходит вместе с заголовками
+    flashes = get_flashed_messages(with_categories=True)
+
+    def iter_reviews():
+        cursor = rows
+        if cursor is None:
+            # вся история читается из курсора уже во время стриминга: соединение
+            # view к этому моменту закрыто teardown-ом, get_db() откроет новое
+            cursor = get_db().execute(query + order, (uid,))
+        for r in cursor:
+            yield {
+                'id': r['id'],
+                'rating': r['rating'],
+                'created_at': r['created_at'],
+                'status': r['status_name'],
+                'book_id': r['book_id'],
+                'book_title': r['book_title'],
+                'html': render_review_text(r['text'])
+            }
 
-    return render_template('my_reviews.html', reviews=reviews)
+    return stream_template('my_reviews.html', reviews=iter_reviews(), flashes=flashes,
+                           paged=paged, first_page=before is None, next_before=next_before)
 
 
 @bp.route('/moderation/reviews')
@@ -500,12 +460,42 @@ def moderation_list():
         page = int(request.args.get('page', '1'))
     except ValueError:
         page = 1
-    per_page = 10
+    per_page = MODERATION_PER_PAGE
     offset = (page - 1) * per_page
 
     db = get_db()
+    uid = g.user['id']
+    pending_id = moderation.status_id(db, moderation.PENDING_STATUS)
+
+    def to_item(r):
+        return {
+            'id': r['id'],
+            'created_at': r['created_at'],
+            'username': r['username'],
+            'name': ' '.join(filter(None, [r['last_name'], r['first_name']])),
+            'book_id': r['book_id'],
+            'book_title': r['book_title']
+        }
+
+    # свои взятые в работу — отдельным запросом по idx_review_leases_moderator
+    claimed = [to_item(r) for r in db.execute(
+        "SELECT r.id, r.created_at, u.username, u.last_name, u.first_name, b.id as book_id, b.title as book_title "
+        "FROM review_leases l "
+        "JOIN reviews r ON r.id = l.review_id "
+        "JOIN users u ON r.user_id = u.id "
+        "JOIN books b ON r.book_id = b.id "
+        "WHERE l.moderator_id = ? AND l.expires_at > datetime('now') AND r.status_id = ? "
+        "ORDER BY r.created_at ASC, r.id ASC",
+        (uid, pending_id)
+    )]
+
+    # свободная очередь читается в порядке idx_reviews_status_created, без сортировки всего бэклога;
+    # рецензии, взятые в работу кем-либо, в неё не входят
     total_row = db.execute(
-        "SELECT COUNT(*) as cnt FROM reviews r JOIN review_statuses rs ON r.status_id = rs.id WHERE rs.name = 'на рассмотрении'"
+        "SELECT COUNT(*) as cnt FROM reviews r "
+        "WHERE r.status_id = ? AND NOT EXISTS ("
+        "SELECT 1 FROM review_leases l WHERE l.review_id = r.id AND l.expires_at > datetime('now'))",
+        (pending_id,)
     ).fetchone()
     total = total_row['cnt'] if total_row else 0
     total_pages = math.ceil(total / per_page) if total > 0 else 1
@@ -513,26 +503,54 @@ def moderation_list():
     rows = db.execute(
         "SELECT r.id, r.created_at, u.username, u.last_name, u.first_name, b.id as book_id, b.title as book_title "
         "FROM reviews r "
-        "JOIN review_statuses rs ON r.status_id = rs.id "
         "JOIN users u ON r.user_id = u.id "
         "JOIN books b ON r.book_id = b.id "
-        "WHERE rs.name = 'на рассмотрении' "
-        "ORDER BY r.created_at ASC LIMIT ? OFFSET ?",
-        (per_page, offset)
+        "WHERE r.status_id = ? AND NOT EXISTS ("
+        "SELECT 1 FROM review_leases l WHERE l.review_id = r.id AND l.expires_at > datetime('now')) "
+        "ORDER BY r.created_at ASC, r.id ASC LIMIT ? OFFSET ?",
+        (pending_id, per_page, offset)
     ).fetchall()
+    items = [to_item(r) for r in rows]
+
+    return render_template('moderation_list.html', reviews=items, claimed=claimed, page=page,
+                           total_pages=total_pages, batch_size=MODERATION_PER_PAGE)
 
-    items = []
-    for r in rows:
-        items.append({
-            'id': r['id'],
-            'created_at': r['created_at'],
-            'username': r['username'],
-            'name': ' '.join(filter(None, [r['last_name'], r['first_name']])),
-            'book_id': r['book_id'],
-            'book_title': r['book_title']
-        })
 
-    return render_template('moderation_list.html', reviews=items, page=page, total_pages=total_pages)
+@bp.route('/moderation/reviews/claim', methods=['POST'])
+@roles_required('модератор')
+def moderation_claim():
+    """Взять в работу следующую пачку рецензий из очереди"""
+    db = get_db()
+    count = moderation.claim_batch(db, g.user['id'], MODERATION_PER_PAGE)
+    if count:
+        flash(f'Взято в работу рецензий: {count}', 'success')
+    else:
+        flash('Свободных рецензий на рассмотрении нет', 'error')
+    return redirect(url_for('books.moderation_list'))
+
+
+@bp.route('/moderation/reviews/batch', methods=['POST'])
+@roles_required('модератор')
+def moderation_batch():
+    """Одобрить/отклонить отмеченные рецензии одной транзакцией"""
+    action = request.form.get('action')
+    review_ids = moderation.parse_review_ids(request.form.getlist('review_ids'))
+    page = request.form.get('page', '1')
+
+    if action not in moderation.DECISIONS:
+        flash('Неизвестное действие', 'error')
+    elif not review_ids:
+        flash('Не выбрано ни одной рецензии', 'error')
+    else:
+        db = get_db()
+        count = moderation.decide_reviews(db, g.user['id'], review_ids, action)
+        verb = 'Одобрено' if action == 'approve' else 'Отклонено'
+        flash(f'{verb} рецензий: {count}', 'success')
+        skipped = len(review_ids) - count
+        if skipped:
+            flash(f'Пропущено {skipped}: уже рассмотрены или в работе у другого модератора', 'error')
+
+    return redirect(url_for('books.moderation_list', page=page))
 
 
 @bp.route('/moderation/review/<int:review_id>', methods=['GET', 'POST'])
@@ -553,6 +571,11 @@ def moderation_review(review_id):
         flash('Рецензия не найдена', 'error')
         return redirect(url_for('books.moderation_list'))
 
+    uid = g.user['id']
+    if row['status_name'] == moderation.PENDING_STATUS and not moderation.claim_review(db, uid, review_id):
+        flash('Рецензия в работе у другого модератора', 'error')
+        return redirect(url_for('books.moderation_list'))
+
     review = {
         'id': row['id'],
         'rating': row['rating'],
@@ -567,24 +590,13 @@ def moderation_review(review_id):
 
     if request.method == 'POST':
         action = request.form.get('action')
-        if action == 'approve':
-            # set status to 'одобрена'
-            db.execute(
-                "UPDATE reviews SET status_id = (SELECT id FROM review_statuses WHERE name='одобрена') WHERE id = ?",
-                (review_id,)
-            )
-            db.commit()
-            flash('Рецензия одобрена', 'success')
-            return redirect(url_for('books.moderation_list'))
-        elif action == 'reject':
-            db.execute(
-                "UPDATE reviews SET status_id = (SELECT id FROM review_statuses WHERE name='отклонена') WHERE id = ?",
-                (review_id,)
-            )
-            db.commit()
-            flash('Рецензия отклонена', 'success')
+        if action in moderation.DECISIONS:
+            if moderation.decide_reviews(db, uid, [review_id], action):
+                flash('Рецензия одобрена' if action == 'approve' else 'Рецензия отклонена', 'success')
+            else:
+                flash('Рецензия уже рассмотрена', 'error')
             return redirect(url_for('books.moderation_list'))
         else:
             flash('Неизвестное действие', 'error')
 
-    return render_template('moderation_review.html', review=review)
\ No newline at end of file
+    return render_template('moderation_review.html', review=review)
@@ -0,0 +1,205 @@
+import errno
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .db import get_db
+
+# --- Проверка целостности обложек и сборка «сирот» ---
+# Файлы хэшируются в пуле потоков крупными блоками (hashlib отпускает GIL),
+# строки covers обходятся пачками по id. После каждой пачки в instance/
+# пишется контрольная точка, поэтому прерванная проверка продолжается с места
+# остановки. В памяти — только текущая пачка, в вывод — только проблемы,
+# ход проверки (строка на пачку) — в stderr.
+
+ALLOWED_EXT = {'png', 'jpg', 'jpeg', 'gif'}
+READ_SIZE = 1024 * 1024
+BATCH_SIZE = 256
+CHECKPOINT_FILE = 'cover_scan.checkpoint'
+QUARANTINE_DIR = 'cover_quarantine'
+# свежие файлы не трогаем: save_cover_file пишет файл до коммита строки covers
+ORPHAN_GRACE_SECONDS = 3600
+
+
+def file_md5(path, read_size=READ_SIZE):
+    """MD5 файла; читает в один переиспользуемый буфер"""
+    md5 = hashlib.md5()
+    buf = bytearray(read_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            md5.update(view[:n])
+    return md5.hexdigest()
+
+
+def check_cover(static_folder, row):
+    """(id, filename, ожидаемый хэш, фактический хэш, ошибка чтения).
+
+    Нет файла — хэш и ошибка None; иная ошибка ОС (каталог, нет прав) —
+    символьное имя errno, чтобы одна строка не обрывала всю проверку.
+    """
+    cover_id, filename, expected = row
+    try:
+        return cover_id, filename, expected, file_md5(os.path.join(static_folder, filename)), None
+    except FileNotFoundError:
+        return cover_id, filename, expected, None, None
+    except OSError as e:
+        return cover_id, filename, expected, None, errno.errorcode.get(e.errno, str(e.errno))
+
+
+def read_checkpoint(path):
+    """(last_id, проверено, расхождений, нет файла, ошибок чтения) из контрольной точки"""
+    try:
+        with open(path) as f:
+            last_id, checked, mismatched, missing, errors = (int(v) for v in f.read().split())
+        return last_id, checked, mismatched, missing, errors
+    except (FileNotFoundError, ValueError):
+        return 0, 0, 0, 0, 0
+
+
+def write_checkpoint(path, last_id, checked, mismatched, missing, errors):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(f'{last_id} {checked} {mismatched} {missing} {errors}')
+    os.replace(tmp, path)
+
+
+def verify_covers(db, static_folder, checkpoint_path, workers, report, progress=None):
+    """Сверить covers.md5_hash с файлами. Возвращает (проверено, расхождений, отсутствует, ошибок).
+
+    Счётчики хранятся в контрольной точке, поэтому после возобновления
+    итог учитывает и проблемы, найденные до прерывания.
+    """
+    last_id, checked, mismatched, missing, errors = read_checkpoint(checkpoint_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = db.execute(
+                'SELECT id, filename, md5_hash FROM covers WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            rows = [tuple(r) for r in rows]
+            for cover_id, filename, expected, actual, error in pool.map(lambda r: check_cover(static_folder, r), rows):
+                checked += 1
+                if error is not None:
+                    errors += 1
+                    report(f'error\t{cover_id}\t{filename}\t{error}')
+                elif actual is None:
+                    missing += 1
+                    report(f'missing\t{cover_id}\t{filename}')
+                elif actual != expected.lower():
+                    mismatched += 1
+                    report(f'mismatch\t{cover_id}\t{filename}\texpected={expected}\tactual={actual}')
+            last_id = rows[-1][0]
+            write_checkpoint(checkpoint_path, last_id, checked, mismatched, missing, errors)
+            if progress:
+                progress(f'проверено: {checked}, last_id: {last_id}')
+
+    return checked, mismatched, missing, errors
+
+
+def is_orphan_candidate(entry, cutoff):
+    """Только изображения обложек, изменённые раньше cutoff"""
+    if entry.name.startswith('.') or not entry.is_file():
+        return False
+    ext = entry.name.rsplit('.', 1)[-1].lower() if '.' in entry.name else ''
+    return ext in ALLOWED_EXT and entry.stat().st_mtime < cutoff
+
+
+def iter_orphans(db, static_folder, grace_seconds=ORPHAN_GRACE_SECONDS):
+    """Изображения в static, на которые не ссылается ни одна строка covers"""
+    cutoff = time.time() - grace_seconds
+    with os.scandir(static_folder) as it:
+        batch = []
+        for entry in it:
+            if not is_orphan_candidate(entry, cutoff):
+                continue
+            batch.append(entry.name)
+            if len(batch) >= BATCH_SIZE:
+                yield from unreferenced(db, batch)
+                batch = []
+        if batch:
+            yield from unreferenced(db, batch)
+
+
+def quarantine_name(quarantine, name):
+    """Свободное имя в карантине: при совпадении добавляется суффикс -1, -2, ..."""
+    if not os.path.exists(os.path.join(quarantine, name)):
+        return name
+    stem, dot, ext = name.rpartition('.')
+    n = 1
+    while os.path.exists(os.path.join(quarantine, f'{stem}-{n}{dot}{ext}')):
+        n += 1
+    return f'{stem}-{n}{dot}{ext}'
+
+
+def unreferenced(db, names):
+    placeholders = ','.join(['?'] * len(names))
+    known = {r['filename'] for r in db.execute(
+        f'SELECT filename FROM covers WHERE filename IN ({placeholders})', names
+    )}
+    return [n for n in names if n not in known]
+
+
+@click.command('scan-covers')
+@click.option('--workers', default=min(32, (os.cpu_count() or 1) * 4), show_default=True,
+              help='Число потоков хэширования')
+@click.option('--orphans', type=click.Choice(['report', 'delete', 'quarantine']), default='report',
+              show_default=True, help='Что делать с файлами без строки в covers')
+@click.option('--grace', 'grace_seconds', default=ORPHAN_GRACE_SECONDS, show_default=True,
+              help='Не считать сиротами файлы моложе стольких секунд')
+@click.option('--restart', is_flag=True, help='Игнорировать контрольную точку и проверить всё заново')
+@with_appcontext
+def scan_covers_command(workers, orphans, grace_seconds, restart):
+    """Проверить md5 обложек и найти файлы-«сироты» в static"""
+    db = get_db()
+    static_folder = current_app.static_folder
+    checkpoint_path = os.path.join(current_app.instance_path, CHECKPOINT_FILE)
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    checked, mismatched, missing, errors = verify_covers(
+        db, static_folder, checkpoint_path, workers, click.echo,
+        progress=lambda line: click.echo(line, err=True)
+    )
+
+    quarantine = os.path.join(current_app.instance_path, QUARANTINE_DIR)
+    orphan_count = 0
+    for name in iter_orphans(db, static_folder, grace_seconds):
+        orphan_count += 1
+        path = os.path.join(static_folder, name)
+        if orphans == 'delete':
+            os.remove(path)
+            click.echo(f'orphan\t{name}\tdeleted')
+        elif orphans == 'quarantine':
+            os.makedirs(quarantine, exist_ok=True)
+            target = quarantine_name(quarantine, name)
+            shutil.move(path, os.path.join(quarantine, target))
+            if target == name:
+                click.echo(f'orphan\t{name}\tquarantined')
+            else:
+                click.echo(f'orphan\t{name}\tquarantined as {target}')
+        else:
+            click.echo(f'orphan\t{name}')
+
+    # проверка дошла до конца — следующая начнётся сначала
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    click.echo(f'Проверено обложек: {checked}, расхождений md5: {mismatched}, '
+               f'нет файла: {missing}, ошибок чтения: {errors}, сирот: {orphan_count}')
+
+
+def init_app(app):
+    app.cli.add_command(scan_covers_command)
@@ -15,5 +15,46 @@ def close_db(e=None):
     if db is not None:
         db.close()
 
+# Таблицы, которых нет в исходном дампе: создаются при старте приложения
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_leases (
+  review_id INTEGER PRIMARY KEY,
+  moderator_id INTEGER NOT NULL,
+  expires_at DATETIME NOT NULL,
+  FOREIGN KEY (review_id) REFERENCES reviews(id) ON DELETE CASCADE,
+  FOREIGN KEY (moderator_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_review_leases_moderator ON review_leases(moderator_id, expires_at);
+CREATE INDEX IF NOT EXISTS idx_covers_filename ON covers(filename);
+CREATE INDEX IF NOT EXISTS idx_reviews_user_created ON reviews(user_id, created_at);
+CREATE TABLE IF NOT EXISTS book_similar (
+  book_id INTEGER NOT NULL,
+  rank INTEGER NOT NULL,
+  similar_book_id INTEGER NOT NULL,
+  score REAL NOT NULL,
+  PRIMARY KEY (book_id, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_book_similar_similar ON book_similar(similar_book_id);
+CREATE TABLE IF NOT EXISTS book_similar_state (
+  book_id INTEGER PRIMARY KEY,
+  signature TEXT NOT NULL,
+  norm REAL NOT NULL,
+  top_n INTEGER NOT NULL
+);
+DROP INDEX IF EXISTS idx_book_genres_genre;
+CREATE INDEX IF NOT EXISTS idx_book_genres_genre_book ON book_genres(genre_id, book_id);
+"""
+
+def ensure_schema():
+    db = get_db()
+    # состояние «похожих книг» — кэш: таблицу старого формата проще пересоздать
+    columns = {r['name'] for r in db.execute('PRAGMA table_info(book_similar_state)')}
+    if columns and 'top_n' not in columns:
+        db.execute('DROP TABLE book_similar_state')
+    db.executescript(SCHEMA)
+    db.commit()
+
 def init_app(app):
     app.teardown_appcontext(close_db)
+    with app.app_context():
+        ensure_schema()
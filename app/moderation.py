@@ -0,0 +1,110 @@
+from flask import current_app
+
+# --- Очередь модерации: аренда (lease) рецензий и пакетные решения ---
+# Модератор берёт в работу пачку рецензий из очереди «на рассмотрении»:
+# строки в review_leases закрепляют их за ним на MODERATION_LEASE_SECONDS.
+# Захват идёт под BEGIN IMMEDIATE, поэтому параллельные модераторы получают
+# непересекающиеся пачки, а чужие активные аренды решения не принимают.
+
+PENDING_STATUS = 'на рассмотрении'
+
+DECISIONS = {
+    'approve': 'одобрена',
+    'reject': 'отклонена',
+}
+
+EXPIRE_LEASES = "DELETE FROM review_leases WHERE expires_at <= datetime('now')"
+
+
+def status_id(db, name):
+    row = db.execute('SELECT id FROM review_statuses WHERE name = ?', (name,)).fetchone()
+    return row['id'] if row else None
+
+
+def lease_modifier():
+    """Модификатор для datetime('now', ?) — срок аренды"""
+    return f"+{int(current_app.config.get('MODERATION_LEASE_SECONDS', 600))} seconds"
+
+
+def parse_review_ids(values):
+    """Список id рецензий из формы: только целые, без повторов"""
+    ids = []
+    for v in values:
+        try:
+            rid = int(v)
+        except (TypeError, ValueError):
+            continue
+        if rid not in ids:
+            ids.append(rid)
+    return ids
+
+
+def claim_batch(db, moderator_id, limit):
+    """Продлить свои аренды и взять в работу до limit свободных рецензий.
+
+    Возвращает число новых рецензий, закреплённых за модератором.
+    """
+    pending_id = status_id(db, PENDING_STATUS)
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(EXPIRE_LEASES)
+        db.execute(
+            "UPDATE review_leases SET expires_at = datetime('now', ?) WHERE moderator_id = ?",
+            (lease_modifier(), moderator_id)
+        )
+        cur = db.execute(
+            "INSERT INTO review_leases (review_id, moderator_id, expires_at) "
+            "SELECT r.id, ?, datetime('now', ?) FROM reviews r "
+            "WHERE r.status_id = ? "
+            "AND NOT EXISTS (SELECT 1 FROM review_leases l WHERE l.review_id = r.id) "
+            "ORDER BY r.created_at ASC, r.id ASC LIMIT ?",
+            (moderator_id, lease_modifier(), pending_id, limit)
+        )
+    return cur.rowcount
+
+
+def claim_review(db, moderator_id, review_id):
+    """Взять в работу одну рецензию. False — если она в работе у другого модератора."""
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(EXPIRE_LEASES)
+        db.execute(
+            "INSERT INTO review_leases (review_id, moderator_id, expires_at) "
+            "VALUES (?, ?, datetime('now', ?)) "
+            "ON CONFLICT(review_id) DO UPDATE SET expires_at = excluded.expires_at "
+            "WHERE review_leases.moderator_id = excluded.moderator_id",
+            (review_id, moderator_id, lease_modifier())
+        )
+        owner = db.execute(
+            'SELECT moderator_id FROM review_leases WHERE review_id = ?', (review_id,)
+        ).fetchone()
+    return owner is not None and owner['moderator_id'] == moderator_id
+
+
+def decide_reviews(db, moderator_id, review_ids, action):
+    """Одобрить/отклонить рецензии одной транзакцией.
+
+    Меняются только рецензии «на рассмотрении», не арендованные другим
+    модератором; аренды решённых рецензий снимаются. Возвращает число
+    изменённых рецензий.
+    """
+    if action not in DECISIONS or not review_ids:
+        return 0
+    pending_id = status_id(db, PENDING_STATUS)
+    target_id = status_id(db, DECISIONS[action])
+    placeholders = ','.join(['?'] * len(review_ids))
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(EXPIRE_LEASES)
+        cur = db.execute(
+            f"UPDATE reviews SET status_id = ? "
+            f"WHERE id IN ({placeholders}) AND status_id = ? "
+            "AND NOT EXISTS (SELECT 1 FROM review_leases l "
+            "WHERE l.review_id = reviews.id AND l.moderator_id != ?)",
+            (target_id, *review_ids, pending_id, moderator_id)
+        )
+        db.execute(
+            f"DELETE FROM review_leases WHERE moderator_id = ? AND review_id IN ({placeholders})",
+            (moderator_id, *review_ids)
+        )
+    return cur.rowcount
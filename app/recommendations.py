@@ -0,0 +1,313 @@
+import bisect
+import hashlib
+import heapq
+import math
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+
+from .db import get_db
+
+# --- «Похожие книги»: офлайн-расчёт item-item сходства ---
+# Книга — разреженный вектор: оценки пользователей (rating / 5) плюс
+# индикаторы жанров с весом GENRE_WEIGHT. Скалярные произведения считаются
+# только для кандидатов: книг с общими читателями (индекс пользователь ->
+# книги) и ограниченного окна книг того же жанра, без плотной матрицы.
+# Top-N соседей сохраняются в book_similar, book_view читает их одним
+# запросом по первичному ключу (book_id, rank). Инкрементальный пересчёт
+# загружает только оценки читателей и жанровые окна изменившихся книг.
+
+TOP_N = 5
+GENRE_WEIGHT = 0.5
+# книги, связанные только жанром, сравниваются лишь с соседями по id в этом окне
+GENRE_WINDOW = 50
+REJECTED_STATUS = 'отклонена'
+CHUNK = 500
+
+
+def chunks(items, size=CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_similar_books(db, book_id, limit=TOP_N):
+    """Похожие книги из предрасчитанной таблицы"""
+    return db.execute(
+        "SELECT b.id, b.title, b.author, s.score "
+        "FROM book_similar s JOIN books b ON b.id = s.similar_book_id "
+        "WHERE s.book_id = ? ORDER BY s.rank LIMIT ?",
+        (book_id, limit)
+    ).fetchall()
+
+
+def book_signatures(db, rejected_id):
+    """Отпечаток (md5) оценок и жанров каждой книги — по нему ищутся изменившиеся книги"""
+    reviews = dict(db.execute(
+        "SELECT book_id, GROUP_CONCAT(id || ':' || user_id || ':' || rating) FROM ("
+        "  SELECT book_id, id, user_id, rating FROM reviews WHERE status_id IS NOT ? ORDER BY book_id, id"
+        ") GROUP BY book_id",
+        (rejected_id,)
+    ).fetchall())
+    genres = dict(db.execute(
+        "SELECT book_id, GROUP_CONCAT(genre_id) FROM ("
+        "  SELECT book_id, genre_id FROM book_genres ORDER BY book_id, genre_id"
+        ") GROUP BY book_id"
+    ).fetchall())
+    return {
+        r['id']: hashlib.md5(f"{reviews.get(r['id'], '')}|{genres.get(r['id'], '')}".encode()).hexdigest()
+        for r in db.execute('SELECT id FROM books')
+    }
+
+
+class RatingIndex:
+    """Часть разреженной матрицы книга × (пользователь, жанр), загружаемая по требованию.
+
+    Кандидаты в соседи книги — книги с общими читателями и, по жанру, только
+    книги того же жанра с id в пределах ±GENRE_WINDOW. Отношение симметрично
+    и не зависит от прочих книг, поэтому инкрементальный пересчёт совпадает
+    с полным, а жанровый член стоит O(GENRE_WINDOW) на книгу вместо
+    O(размер жанра).
+    """
+
+    def __init__(self, db, rejected_id):
+        self.db = db
+        self.rejected_id = rejected_id
+        self.book_users = {}
+        self.user_books = {}
+        self.genres_of = {}
+        self.window = {}
+        self.norms = {}
+
+    def load(self, books):
+        """Загрузить векторы книг, все оценки их читателей и жанровые окна"""
+        db = self.db
+        books = [b for b in books if b not in self.book_users]
+        users = set()
+
+        for part in chunks(books):
+            placeholders = ','.join(['?'] * len(part))
+            for book_id in part:
+                self.book_users[book_id] = []
+                self.window[book_id] = set()
+            for book_id, user_id, rating in db.execute(
+                f"SELECT book_id, user_id, rating FROM reviews "
+                f"WHERE book_id IN ({placeholders}) AND status_id IS NOT ?",
+                (*part, self.rejected_id)
+            ):
+                self.book_users[book_id].append((user_id, rating / 5))
+                users.add(user_id)
+        self.load_genres(books)
+
+        for book_id in books:
+            self.norms[book_id] = (
+                sum(w * w for _, w in self.book_users[book_id])
+                + len(self.genres_of[book_id]) * GENRE_WEIGHT * GENRE_WEIGHT
+            )
+
+        for part in chunks(users - set(self.user_books)):
+            placeholders = ','.join(['?'] * len(part))
+            for user_id in part:
+                self.user_books[user_id] = []
+            for user_id, book_id, rating in db.execute(
+                f"SELECT r.user_id, r.book_id, r.rating FROM reviews r JOIN books b ON b.id = r.book_id "
+                f"WHERE r.user_id IN ({placeholders}) AND r.status_id IS NOT ?",
+                (*part, self.rejected_id)
+            ):
+                self.user_books[user_id].append((book_id, rating / 5))
+
+        self.load_windows(books)
+
+    def load_genres(self, books):
+        missing = [b for b in books if b not in self.genres_of]
+        for part in chunks(missing):
+            placeholders = ','.join(['?'] * len(part))
+            for book_id in part:
+                self.genres_of[book_id] = set()
+            for book_id, genre_id in self.db.execute(
+                f"SELECT book_id, genre_id FROM book_genres WHERE book_id IN ({placeholders})", part
+            ):
+                self.genres_of[book_id].add(genre_id)
+
+    def load_windows(self, books):
+        """Соседи по жанру: книги того же жанра с id в [book - GENRE_WINDOW, book + GENRE_WINDOW]"""
+        by_genre = defaultdict(list)
+        for book_id in books:
+            for genre_id in self.genres_of[book_id]:
+                by_genre[genre_id].append(book_id)
+
+        for genre_id, targets in by_genre.items():
+            targets.sort()
+            # пересекающиеся окна читаются одним диапазоном idx_book_genres_genre_book
+            ranges = []
+            for book_id in targets:
+                lo, hi = book_id - GENRE_WINDOW, book_id + GENRE_WINDOW
+                if ranges and lo <= ranges[-1][1]:
+                    ranges[-1][1] = hi
+                else:
+                    ranges.append([lo, hi])
+            members = []
+            for lo, hi in ranges:
+                members += [r[0] for r in self.db.execute(
+                    "SELECT bg.book_id FROM book_genres bg JOIN books b ON b.id = bg.book_id "
+                    "WHERE bg.genre_id = ? AND bg.book_id BETWEEN ? AND ? ORDER BY bg.book_id",
+                    (genre_id, lo, hi)
+                )]
+            for book_id in targets:
+                start = bisect.bisect_left(members, book_id - GENRE_WINDOW)
+                stop = bisect.bisect_right(members, book_id + GENRE_WINDOW)
+                self.window[book_id].update(members[start:stop])
+
+    def load_norms(self, books):
+        missing = [b for b in books if b not in self.norms]
+        for part in chunks(missing):
+            placeholders = ','.join(['?'] * len(part))
+            for row in self.db.execute(
+                f'SELECT book_id, norm FROM book_similar_state WHERE book_id IN ({placeholders})', part
+            ):
+                self.norms[row['book_id']] = row['norm']
+        # книги без сохранённой нормы (например, после сбоя) — считаем из их строк
+        missing = [b for b in missing if b not in self.norms]
+        self.load_genres(missing)
+        for part in chunks(missing):
+            placeholders = ','.join(['?'] * len(part))
+            sums = dict(self.db.execute(
+                f"SELECT book_id, SUM((rating / 5.0) * (rating / 5.0)) FROM reviews "
+                f"WHERE book_id IN ({placeholders}) AND status_id IS NOT ? GROUP BY book_id",
+                (*part, self.rejected_id)
+            ).fetchall())
+            for book_id in part:
+                self.norms[book_id] = (sums.get(book_id) or 0) + len(self.genres_of[book_id]) * GENRE_WEIGHT * GENRE_WEIGHT
+
+    def scores(self, book_id):
+        """Косинусное сходство книги с её кандидатами (общие читатели, жанровое окно)"""
+        norm = self.norms.get(book_id)
+        if not norm:
+            return {}
+        dots = defaultdict(float)
+        for user_id, w in self.book_users[book_id]:
+            for other, w2 in self.user_books[user_id]:
+                dots[other] += w * w2
+        candidates = set(dots) | self.window[book_id]
+        candidates.discard(book_id)
+
+        self.load_genres(candidates)
+        self.load_norms(candidates)
+        genres = self.genres_of[book_id]
+        result = {}
+        for other in candidates:
+            dot = dots.get(other, 0.0) + len(genres & self.genres_of[other]) * GENRE_WEIGHT * GENRE_WEIGHT
+            if dot > 0 and self.norms[other]:
+                result[other] = dot / math.sqrt(norm * self.norms[other])
+        return result
+
+
+def top(scored, top_n):
+    return heapq.nlargest(top_n, scored)
+
+
+def refresh_similar_books(db, full=False, top_n=TOP_N):
+    """Пересчитать «похожие книги».
+
+    Без full полностью пересчитываются только изменившиеся книги и книги,
+    в чьих сохранённых списках они упомянуты. Остальным соседям новая оценка
+    вставляется в сохранённый top-N, только если она выше его минимума.
+    Если сохранённые списки построены с другим top_n, пересчёт всегда полный.
+    Возвращает (обновлено списков, удалено книг).
+    """
+    row = db.execute('SELECT id FROM review_statuses WHERE name = ?', (REJECTED_STATUS,)).fetchone()
+    rejected_id = row['id'] if row else None
+
+    current = book_signatures(db, rejected_id)
+    stored = {
+        r['book_id']: r['signature'] for r in db.execute('SELECT book_id, signature FROM book_similar_state')
+    }
+    removed = set(stored) - set(current)
+    # сохранённые списки обрезаны по прежнему --top: слияние с ними дало бы неверный top-N
+    if db.execute('SELECT 1 FROM book_similar_state WHERE top_n != ? LIMIT 1', (top_n,)).fetchone():
+        full = True
+    if full:
+        stored = {}
+    changed = {b for b, sig in current.items() if stored.get(b) != sig}
+
+    index = RatingIndex(db, rejected_id)
+    index.load(changed)
+
+    lists = {}
+    incoming = defaultdict(list)
+    for book_id in changed:
+        scores = index.scores(book_id)
+        lists[book_id] = top(((s, other) for other, s in scores.items()), top_n)
+        if not full:
+            for other, score in scores.items():
+                if other not in changed:
+                    incoming[other].append((score, book_id))
+
+    if not full:
+        # в списке упомянута изменившаяся или удалённая книга: её оценка упала
+        # или исчезла, и вытесненный ранее кандидат может вернуться — пересчёт целиком
+        recompute = set()
+        for part in chunks(changed | removed):
+            placeholders = ','.join(['?'] * len(part))
+            recompute.update(r['book_id'] for r in db.execute(
+                f'SELECT DISTINCT book_id FROM book_similar WHERE similar_book_id IN ({placeholders})', part
+            ))
+        recompute = (recompute & set(current)) - changed
+        index.load(recompute)
+        for book_id in recompute:
+            lists[book_id] = top(((s, other) for other, s in index.scores(book_id).items()), top_n)
+
+        # прочим соседям оценки с остальными книгами не менялись — достаточно слияния
+        for part in chunks(set(incoming) - recompute):
+            placeholders = ','.join(['?'] * len(part))
+            saved = defaultdict(list)
+            for r in db.execute(
+                f'SELECT book_id, similar_book_id, score FROM book_similar '
+                f'WHERE book_id IN ({placeholders}) ORDER BY book_id, rank', part
+            ):
+                saved[r['book_id']].append((r['score'], r['similar_book_id']))
+            for book_id in part:
+                old = saved[book_id]
+                if len(old) >= top_n and max(incoming[book_id])[0] <= old[-1][0]:
+                    continue
+                lists[book_id] = top(old + incoming[book_id], top_n)
+
+    with db:
+        if full:
+            db.execute('DELETE FROM book_similar')
+            db.execute('DELETE FROM book_similar_state')
+        for part in chunks(removed):
+            placeholders = ','.join(['?'] * len(part))
+            db.execute(f'DELETE FROM book_similar WHERE book_id IN ({placeholders})', part)
+            db.execute(f'DELETE FROM book_similar_state WHERE book_id IN ({placeholders})', part)
+
+        for part in chunks(lists):
+            placeholders = ','.join(['?'] * len(part))
+            db.execute(f'DELETE FROM book_similar WHERE book_id IN ({placeholders})', part)
+            db.executemany(
+                'INSERT INTO book_similar (book_id, rank, similar_book_id, score) VALUES (?, ?, ?, ?)',
+                [(book_id, rank, other, round(score, 6))
+                 for book_id in part
+                 for rank, (score, other) in enumerate(lists[book_id], start=1)]
+            )
+        db.executemany(
+            'INSERT OR REPLACE INTO book_similar_state (book_id, signature, norm, top_n) VALUES (?, ?, ?, ?)',
+            [(book_id, current[book_id], index.norms[book_id], top_n) for book_id in changed]
+        )
+
+    return len(lists), len(removed)
+
+
+@click.command('build-recommendations')
+@click.option('--full', is_flag=True, help='Пересчитать все книги, а не только изменившиеся')
+@click.option('--top', 'top_n', default=TOP_N, show_default=True, help='Сколько похожих книг хранить')
+@with_appcontext
+def build_recommendations_command(full, top_n):
+    """Построить таблицу «похожих книг» по оценкам и жанрам"""
+    updated, removed = refresh_similar_books(get_db(), full=full, top_n=top_n)
+    click.echo(f'Пересчитано книг: {updated}, удалено: {removed}')
+
+
+def init_app(app):
+    app.cli.add_command(build_recommendations_command)
@@ -0,0 +1,128 @@
+from functools import lru_cache
+
+# --- Компилятор поискового запроса ---
+# Фильтры превращаются в условия над одной таблицей books: жанры проверяются
+# полусоединением EXISTS, поэтому строки не размножаются и GROUP BY не нужен.
+# Сначала отбираются id книг страницы, и только для них подтягиваются жанры,
+# обложка и статистика рецензий.
+
+BASE_FROM = "FROM books b"
+ORDER_BY = "ORDER BY b.year DESC, b.id DESC"
+
+
+def filter_shape(filters):
+    """Форма фильтра: какие условия включены и сколько значений в IN (...)"""
+    return (
+        bool(filters['title']),
+        bool(filters['author']),
+        len(filters['genres']),
+        len(filters['years']),
+        filters['pages_min'] is not None,
+        filters['pages_max'] is not None,
+        filters['invalid'],
+    )
+
+
+def normalize_filters(filters):
+    """Привести значения фильтров к типам, которые уходят в параметры запроса"""
+
+    def to_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    genres = [to_int(v) for v in filters['genres']]
+    years = [to_int(v) for v in filters['years']]
+    return {
+        'title': filters['title'],
+        'author': filters['author'],
+        'genres': [gid for gid in genres if gid is not None],
+        'years': [y for y in years if y is not None],
+        'pages_min': to_int(filters['pages_min']) if filters['pages_min'] else None,
+        'pages_max': to_int(filters['pages_max']) if filters['pages_max'] else None,
+        # нечисловой жанр/год не совпадает ни с одной книгой — фильтр должен сужать, а не отбрасываться
+        'invalid': None in genres or None in years,
+    }
+
+
+@lru_cache(maxsize=128)
+def compile_search(shape):
+    """Собрать текст запросов (count, page) для формы фильтра.
+
+    Результат кэшируется: одинаковые формы фильтра дают один и тот же текст,
+    так что и sqlite3 переиспользует подготовленный statement.
+    """
+    has_title, has_author, n_genres, n_years, has_min, has_max, invalid = shape
+    conditions = []
+
+    if invalid:
+        conditions.append("1 = 0")
+    if has_title:
+        conditions.append("b.title LIKE ?")
+    if has_author:
+        conditions.append("b.author LIKE ?")
+    if n_genres:
+        placeholders = ','.join(['?'] * n_genres)
+        conditions.append(
+            "EXISTS (SELECT 1 FROM book_genres bg "
+            f"WHERE bg.book_id = b.id AND bg.genre_id IN ({placeholders}))"
+        )
+    if n_years:
+        placeholders = ','.join(['?'] * n_years)
+        conditions.append(f"b.year IN ({placeholders})")
+    if has_min:
+        conditions.append("b.pages >= ?")
+    if has_max:
+        conditions.append("b.pages <= ?")
+
+    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+    count_query = f"SELECT COUNT(*) as cnt {BASE_FROM} {where_clause}"
+
+    page_query = f"""
+    WITH page AS (
+        SELECT b.id {BASE_FROM} {where_clause}
+        {ORDER_BY}
+        LIMIT ? OFFSET ?
+    )
+    SELECT b.id, b.title, b.year, b.author, b.pages,
+           (SELECT GROUP_CONCAT(g.name, ', ')
+              FROM book_genres bg JOIN genres g ON g.id = bg.genre_id
+             WHERE bg.book_id = b.id) as genres,
+           COALESCE((SELECT ROUND(AVG(r.rating), 2) FROM reviews r WHERE r.book_id = b.id), 0) as avg_rating,
+           (SELECT COUNT(*) FROM reviews r WHERE r.book_id = b.id) as review_count,
+           (SELECT c.filename FROM covers c WHERE c.book_id = b.id ORDER BY c.id LIMIT 1) as cover
+    FROM page JOIN books b ON b.id = page.id
+    {ORDER_BY}
+    """
+
+    return count_query, page_query
+
+
+def search_params(filters):
+    """Параметры запроса в том же порядке, что и условия в compile_search"""
+    params = []
+    if filters['title']:
+        params.append(f"%{filters['title']}%")
+    if filters['author']:
+        params.append(f"%{filters['author']}%")
+    params.extend(filters['genres'])
+    params.extend(filters['years'])
+    if filters['pages_min'] is not None:
+        params.append(filters['pages_min'])
+    if filters['pages_max'] is not None:
+        params.append(filters['pages_max'])
+    return params
+
+
+def search_books(db, filters, page, per_page):
+    """Выполнить поиск и вернуть (total, книги текущей страницы)"""
+    filters = normalize_filters(filters)
+    count_query, page_query = compile_search(filter_shape(filters))
+    params = search_params(filters)
+
+    total = db.execute(count_query, params).fetchone()['cnt']
+    offset = (page - 1) * per_page
+    books = db.execute(page_query, params + [per_page, offset]).fetchall()
+    return total, books
@@ -0,0 +1,26 @@
+import os
+import shutil
+
+import pytest
+
+from app import create_app
+from app import auth
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Приложение на копии учебной базы: исходный instance/library.db не меняется"""
+    db_path = tmp_path / 'library.db'
+    shutil.copy(os.path.join(ROOT, 'instance', 'library.db'), db_path)
+    return create_app({'DATABASE': str(db_path), 'TESTING': True})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username):
+    return client.post('/auth/login', data={'username': username, 'password': auth.PASSWORD_MAP[username]})
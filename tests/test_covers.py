@@ -0,0 +1,93 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from app.covers import CHECKPOINT_FILE, QUARANTINE_DIR
+from app.db import get_db
+
+
+@pytest.fixture
+def static_dir(app, tmp_path):
+    """Отдельная папка static и таблица covers: ok.jpg верная, bad.jpg испорчена, lost.jpg нет на диске"""
+    static = tmp_path / 'static'
+    static.mkdir()
+    app.static_folder = str(static)
+    app.instance_path = str(tmp_path / 'instance')
+    os.makedirs(app.instance_path)
+
+    (static / 'ok.jpg').write_bytes(b'ok')
+    (static / 'bad.jpg').write_bytes(b'changed')
+    with app.app_context():
+        db = get_db()
+        book_id = db.execute('SELECT MIN(id) FROM books').fetchone()[0]
+        db.execute('DELETE FROM covers')
+        db.executemany(
+            "INSERT INTO covers (id, filename, mime_type, md5_hash, book_id) VALUES (?, ?, 'image/jpeg', ?, ?)",
+            [(1, 'ok.jpg', hashlib.md5(b'ok').hexdigest(), book_id),
+             (2, 'bad.jpg', hashlib.md5(b'original').hexdigest(), book_id),
+             (3, 'lost.jpg', hashlib.md5(b'lost').hexdigest(), book_id)]
+        )
+        db.commit()
+    return static
+
+
+def age(path, seconds):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_scan_reports_mismatch_and_missing(app, static_dir):
+    out = app.test_cli_runner().invoke(args=['scan-covers']).output
+    assert 'mismatch\t2\tbad.jpg' in out
+    assert 'missing\t3\tlost.jpg' in out
+    assert 'Проверено обложек: 3, расхождений md5: 1, нет файла: 1, ошибок чтения: 0, сирот: 0' in out
+
+
+def test_delete_spares_fresh_uploads_and_non_cover_files(app, static_dir):
+    for name in ('old.jpg', 'fresh.jpg', 'style.css'):
+        (static_dir / name).write_bytes(b'x')
+    age(static_dir / 'old.jpg', 2 * 3600)
+    age(static_dir / 'style.css', 2 * 3600)
+
+    out = app.test_cli_runner().invoke(args=['scan-covers', '--orphans', 'delete']).output
+    assert 'orphan\told.jpg\tdeleted' in out
+    assert sorted(os.listdir(static_dir)) == ['bad.jpg', 'fresh.jpg', 'ok.jpg', 'style.css']
+
+
+def test_resumed_scan_keeps_earlier_counts(app, static_dir):
+    # прерванный запуск успел проверить 2 обложки и найти одно расхождение
+    with open(os.path.join(app.instance_path, CHECKPOINT_FILE), 'w') as f:
+        f.write('2 2 1 0 0')
+
+    out = app.test_cli_runner().invoke(args=['scan-covers']).output
+    assert 'bad.jpg' not in out
+    assert 'Проверено обложек: 3, расхождений md5: 1, нет файла: 1' in out
+    assert not os.path.exists(os.path.join(app.instance_path, CHECKPOINT_FILE))
+
+
+def test_unreadable_cover_is_reported_and_counted(app, static_dir):
+    # вместо файла обложки — каталог: IsADirectoryError не должен обрывать проверку
+    (static_dir / 'lost.jpg').mkdir()
+
+    result = app.test_cli_runner().invoke(args=['scan-covers'])
+    assert result.exit_code == 0
+    assert 'error\t3\tlost.jpg\tEISDIR' in result.output
+    assert 'нет файла: 0, ошибок чтения: 1' in result.output
+    assert 'проверено: 3, last_id: 3' in result.stderr
+
+
+def test_quarantine_keeps_existing_file(app, static_dir):
+    quarantine = os.path.join(app.instance_path, QUARANTINE_DIR)
+    os.makedirs(quarantine)
+    with open(os.path.join(quarantine, 'old.jpg'), 'wb') as f:
+        f.write(b'earlier')
+    (static_dir / 'old.jpg').write_bytes(b'x')
+    age(static_dir / 'old.jpg', 2 * 3600)
+
+    out = app.test_cli_runner().invoke(args=['scan-covers', '--orphans', 'quarantine']).output
+    assert 'orphan\told.jpg\tquarantined as old-1.jpg' in out
+    assert sorted(os.listdir(quarantine)) == ['old-1.jpg', 'old.jpg']
+    with open(os.path.join(quarantine, 'old.jpg'), 'rb') as f:
+        assert f.read() == b'earlier'
@@ -0,0 +1,158 @@
+import re
+import threading
+
+import pytest
+
+from app import auth, books, moderation
+from app.db import get_db
+from conftest import login
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    """Второй модератор и 25 рецензий на рассмотрении; возвращает id модераторов"""
+    monkeypatch.setitem(auth.PASSWORD_MAP, 'mod2', 'mod2')
+    with app.app_context():
+        db = get_db()
+        mod_role = db.execute("SELECT id FROM roles WHERE name = 'модератор'").fetchone()['id']
+        mod1 = db.execute(
+            'SELECT u.id FROM users u WHERE u.role_id = ? ORDER BY u.id LIMIT 1', (mod_role,)
+        ).fetchone()['id']
+        mod2 = db.execute(
+            "INSERT INTO users (username, password_hash, last_name, first_name, role_id) "
+            "VALUES ('mod2', '-', 'Второй', 'Модератор', ?)", (mod_role,)
+        ).lastrowid
+        author = db.execute("SELECT id FROM users WHERE username = 'weng'").fetchone()['id']
+        books = [r['id'] for r in db.execute('SELECT id FROM books ORDER BY id')]
+        pending = moderation.status_id(db, moderation.PENDING_STATUS)
+        db.execute('DELETE FROM reviews WHERE status_id = ?', (pending,))
+        for i in range(25):
+            db.execute(
+                'INSERT INTO reviews (book_id, user_id, rating, text, status_id) VALUES (?, ?, 4, ?, ?)',
+                (books[i % len(books)], author, f'review {i}', pending)
+            )
+        db.commit()
+    return mod1, mod2
+
+
+def leased(db, moderator_id):
+    return {r['review_id'] for r in db.execute(
+        'SELECT review_id FROM review_leases WHERE moderator_id = ?', (moderator_id,)
+    )}
+
+
+def status_of(db, review_id):
+    return db.execute(
+        'SELECT rs.name FROM reviews r JOIN review_statuses rs ON rs.id = r.status_id WHERE r.id = ?',
+        (review_id,)
+    ).fetchone()['name']
+
+
+def test_claim_batch_gives_disjoint_batches(app, queue):
+    mod1, mod2 = queue
+    with app.app_context():
+        db = get_db()
+        assert moderation.claim_batch(db, mod1, 10) == 10
+        assert moderation.claim_batch(db, mod2, 10) == 10
+        assert moderation.claim_batch(db, mod1, 10) == 5
+        a, b = leased(db, mod1), leased(db, mod2)
+        assert len(a) == 15 and len(b) == 10
+        assert not a & b
+
+
+def test_concurrent_claims_do_not_overlap(app, queue):
+    results = {}
+
+    def claim(moderator_id):
+        with app.app_context():
+            db = get_db()
+            moderation.claim_batch(db, moderator_id, 10)
+            results[moderator_id] = leased(db, moderator_id)
+
+    threads = [threading.Thread(target=claim, args=(m,)) for m in queue]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    a, b = results.values()
+    assert len(a) == 10 and len(b) == 10
+    assert not a & b
+
+
+def test_decide_reviews_skips_other_moderators_leases(app, queue):
+    mod1, mod2 = queue
+    with app.app_context():
+        db = get_db()
+        moderation.claim_batch(db, mod1, 10)
+        moderation.claim_batch(db, mod2, 10)
+        a, b = sorted(leased(db, mod1)), sorted(leased(db, mod2))
+
+        assert moderation.decide_reviews(db, mod2, a[:3] + b[:2], 'approve') == 2
+        assert all(status_of(db, rid) == 'одобрена' for rid in b[:2])
+        assert all(status_of(db, rid) == moderation.PENDING_STATUS for rid in a[:3])
+        # аренды решённых рецензий сняты, чужие не тронуты
+        assert leased(db, mod2) == set(b[2:])
+        assert leased(db, mod1) == set(a)
+
+        # уже рассмотренные повторно не меняются
+        assert moderation.decide_reviews(db, mod2, b[:2], 'reject') == 0
+
+
+def test_expired_leases_are_reclaimed(app, queue):
+    mod1, mod2 = queue
+    with app.app_context():
+        db = get_db()
+        moderation.claim_batch(db, mod1, 25)
+        assert moderation.claim_batch(db, mod2, 10) == 0
+        db.execute("UPDATE review_leases SET expires_at = datetime('now', '-1 seconds')")
+        db.commit()
+        assert moderation.claim_batch(db, mod2, 10) == 10
+        assert moderation.decide_reviews(db, mod2, sorted(leased(db, mod2)), 'reject') == 10
+
+
+def test_batch_view_and_claimed_review_page(app, client, queue):
+    mod1, mod2 = queue
+    login(client, 'mod2')
+    client.post('/moderation/reviews/claim')
+    with app.app_context():
+        ids = sorted(leased(get_db(), mod2))
+
+    page = client.post('/moderation/reviews/batch',
+                       data={'action': 'reject', 'review_ids': ids[:4]},
+                       follow_redirects=True).get_data(as_text=True)
+    assert 'Отклонено рецензий: 4' in page
+
+    other = app.test_client()
+    login(other, 'vafelka')
+    page = other.get(f'/moderation/review/{ids[5]}', follow_redirects=True).get_data(as_text=True)
+    assert 'в работе у другого модератора' in page
+
+
+def test_list_shows_own_claims_and_unclaimed_queue(app, client, queue):
+    mod1, mod2 = queue
+    with app.app_context():
+        db = get_db()
+        moderation.claim_batch(db, mod1, 3)
+        moderation.claim_batch(db, mod2, 10)
+        mine = leased(db, mod1)
+        foreign = leased(db, mod2)
+
+    login(client, 'vafelka')
+    html = client.get('/moderation/reviews').get_data(as_text=True)
+    shown = {int(v) for v in re.findall(r'name="review_ids" value="(\d+)"', html)}
+    assert 'У вас в работе: 3' in html
+    assert mine <= shown
+    assert not foreign & shown
+    # 25 - 3 - 10 свободных: страница из MODERATION_PER_PAGE и ещё одна
+    assert len(shown - mine) == books.MODERATION_PER_PAGE
+    assert 'Страница 1 из 2' in html
+    assert f'Взять в работу {books.MODERATION_PER_PAGE}' in html
+
+
+def test_claim_view_uses_page_size(app, client, queue):
+    mod1, _ = queue
+    login(client, 'vafelka')
+    client.post('/moderation/reviews/claim')
+    with app.app_context():
+        assert len(leased(get_db(), mod1)) == books.MODERATION_PER_PAGE
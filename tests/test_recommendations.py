@@ -0,0 +1,103 @@
+import random
+
+from app.db import get_db
+from app.recommendations import refresh_similar_books
+
+
+def similar_lists(db):
+    lists = {}
+    for r in db.execute('SELECT book_id, similar_book_id, score FROM book_similar ORDER BY book_id, rank'):
+        lists.setdefault(r['book_id'], []).append((r['similar_book_id'], round(r['score'], 5)))
+    return lists
+
+
+def scores_only(lists):
+    return {book_id: [score for _, score in items] for book_id, items in lists.items()}
+
+
+def full_rebuild_matches(db):
+    incremental = similar_lists(db)
+    refresh_similar_books(db, full=True)
+    return scores_only(incremental) == scores_only(similar_lists(db))
+
+
+def set_genres(db, book_id, genre_ids):
+    db.execute('DELETE FROM book_genres WHERE book_id = ?', (book_id,))
+    db.executemany('INSERT INTO book_genres (book_id, genre_id) VALUES (?, ?)',
+                   [(book_id, gid) for gid in genre_ids])
+    db.commit()
+
+
+def test_second_refresh_without_changes_is_noop(app):
+    with app.app_context():
+        db = get_db()
+        refresh_similar_books(db, full=True)
+        assert refresh_similar_books(db) == (0, 0)
+
+
+def test_genre_edit_with_same_count_and_sum_is_detected(app):
+    with app.app_context():
+        db = get_db()
+        book_id = db.execute('SELECT MIN(id) FROM books').fetchone()[0]
+        set_genres(db, book_id, [1, 4])
+        refresh_similar_books(db, full=True)
+
+        set_genres(db, book_id, [2, 3])
+        updated, _ = refresh_similar_books(db)
+        assert updated > 0
+        incremental = similar_lists(db)[book_id]
+
+        refresh_similar_books(db, full=True)
+        assert incremental == similar_lists(db)[book_id]
+
+
+def test_incremental_refresh_matches_full_rebuild(app):
+    rnd = random.Random(28)
+    with app.app_context():
+        db = get_db()
+        books = [r['id'] for r in db.execute('SELECT id FROM books')]
+        genres = [r['id'] for r in db.execute('SELECT id FROM genres')]
+        users = [r['id'] for r in db.execute('SELECT id FROM users')]
+        for book_id in books:
+            for user_id in rnd.sample(users, 2):
+                db.execute('INSERT OR IGNORE INTO reviews (book_id, user_id, rating, text, status_id) '
+                           'VALUES (?, ?, ?, ?, 2)', (book_id, user_id, rnd.randint(0, 5), '-'))
+        db.commit()
+        refresh_similar_books(db, full=True)
+
+        for _ in range(10):
+            book_id = rnd.choice(books)
+            if rnd.random() < 0.5:
+                set_genres(db, book_id, rnd.sample(genres, rnd.randint(0, 2)))
+            else:
+                db.execute('UPDATE reviews SET rating = ? WHERE book_id = ?', (rnd.randint(0, 5), book_id))
+                db.commit()
+            refresh_similar_books(db)
+            assert full_rebuild_matches(db)
+
+
+def test_deleted_book_disappears_from_lists(app):
+    with app.app_context():
+        db = get_db()
+        refresh_similar_books(db, full=True)
+        victim = db.execute('SELECT similar_book_id FROM book_similar LIMIT 1').fetchone()[0]
+        db.execute('DELETE FROM books WHERE id = ?', (victim,))
+        db.commit()
+
+        assert refresh_similar_books(db)[1] == 1
+        assert db.execute('SELECT COUNT(*) FROM book_similar WHERE similar_book_id = ? OR book_id = ?',
+                          (victim, victim)).fetchone()[0] == 0
+        assert full_rebuild_matches(db)
+
+
+def test_changed_top_forces_full_rebuild(app):
+    with app.app_context():
+        db = get_db()
+        refresh_similar_books(db, full=True, top_n=2)
+        books = db.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+
+        assert refresh_similar_books(db, top_n=4)[0] == books
+        incremental = similar_lists(db)
+        refresh_similar_books(db, full=True, top_n=4)
+        assert incremental == similar_lists(db)
+        assert refresh_similar_books(db, top_n=4) == (0, 0)
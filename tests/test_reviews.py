@@ -0,0 +1,79 @@
+import re
+
+from app.db import get_db
+from conftest import login
+
+SAVED = 'Рецензия успешно сохранена'
+
+
+def add_reviews(app, username, count):
+    with app.app_context():
+        db = get_db()
+        uid = db.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()['id']
+        books = [r['id'] for r in db.execute('SELECT id FROM books ORDER BY id')]
+        db.execute('DELETE FROM reviews WHERE user_id = ?', (uid,))
+        for i in range(count):
+            # часть рецензий с одинаковым created_at — порядок держится на id
+            db.execute(
+                "INSERT INTO reviews (book_id, user_id, rating, text, status_id, created_at) "
+                "VALUES (?, ?, 4, ?, 2, datetime('2025-01-01', ?))",
+                (books[i % len(books)], uid, f'review-{i}', f'+{i // 3} minutes')
+            )
+        db.commit()
+
+
+def shown_reviews(html):
+    return re.findall(r'review-(\d+)', html)
+
+
+def test_flash_on_streamed_book_page_is_shown_once(app, client):
+    with app.app_context():
+        db = get_db()
+        book_id = db.execute(
+            "SELECT b.id FROM books b WHERE NOT EXISTS ("
+            "SELECT 1 FROM reviews r JOIN users u ON u.id = r.user_id "
+            "WHERE r.book_id = b.id AND u.username = 'weng') LIMIT 1"
+        ).fetchone()['id']
+    login(client, 'weng')
+
+    client.post(f'/book/{book_id}/review/add', data={'rating': '5', 'text': 'Отлично'})
+    pages = [client.get(f'/book/{book_id}').get_data(as_text=True) for _ in range(3)]
+    assert [SAVED in page for page in pages] == [True, False, False]
+
+
+def test_my_reviews_streams_whole_history(app, client):
+    add_reviews(app, 'weng', 45)
+    login(client, 'weng')
+    response = client.get('/reviews/my')
+    assert response.is_streamed
+    reviews = shown_reviews(response.get_data(as_text=True))
+    assert len(reviews) == 45
+    assert reviews[0] == '44' and reviews[-1] == '0'
+
+
+def test_my_reviews_keyset_pages_cover_history_once(app, client):
+    add_reviews(app, 'weng', 45)
+    login(client, 'weng')
+
+    seen, pages = [], 0
+    url = '/reviews/my?paged=1'
+    while url:
+        html = client.get(url).get_data(as_text=True)
+        pages += 1
+        seen += shown_reviews(html)
+        match = re.search(r'href="(/reviews/my\?before=\d+)"', html)
+        url = match.group(1) if match else None
+
+    assert pages == 3
+    assert seen == [str(i) for i in range(44, -1, -1)]
+
+
+def test_my_reviews_ignores_foreign_cursor(app, client):
+    add_reviews(app, 'weng', 3)
+    with app.app_context():
+        foreign = get_db().execute(
+            "SELECT r.id FROM reviews r JOIN users u ON u.id = r.user_id WHERE u.username != 'weng' LIMIT 1"
+        ).fetchone()
+    login(client, 'weng')
+    html = client.get(f"/reviews/my?before={foreign['id'] if foreign else 0}").get_data(as_text=True)
+    assert shown_reviews(html) == ['2', '1', '0']
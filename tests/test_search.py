@@ -0,0 +1,71 @@
+import pytest
+
+from app.db import get_db
+from app.search import compile_search, filter_shape, normalize_filters, search_books
+
+
+def filters(**values):
+    base = {'title': '', 'author': '', 'genres': [], 'years': [], 'pages_min': '', 'pages_max': ''}
+    base.update(values)
+    return base
+
+
+@pytest.fixture
+def db(app):
+    """Книги с несколькими жанрами: первая — во всех трёх, вторая — в двух, третья — в одном"""
+    with app.app_context():
+        db = get_db()
+        books = [r['id'] for r in db.execute('SELECT id FROM books ORDER BY id LIMIT 3')]
+        layout = {books[0]: [1, 2, 3], books[1]: [1, 2], books[2]: [3]}
+        for book_id, genre_ids in layout.items():
+            db.execute('DELETE FROM book_genres WHERE book_id = ?', (book_id,))
+            db.executemany('INSERT INTO book_genres (book_id, genre_id) VALUES (?, ?)',
+                           [(book_id, gid) for gid in genre_ids])
+        db.commit()
+        yield db
+
+
+def test_multi_genre_filter_counts_distinct_books(db):
+    expected = {r['book_id'] for r in db.execute(
+        'SELECT bg.book_id FROM book_genres bg JOIN books b ON b.id = bg.book_id WHERE bg.genre_id IN (1, 2)'
+    )}
+
+    total, books = search_books(db, filters(genres=['1', '2']), 1, 100)
+    ids = [b['id'] for b in books]
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected
+    assert total == len(expected)
+
+
+def test_matched_book_shows_all_its_genres(db):
+    book_id = db.execute(
+        'SELECT bg.book_id FROM book_genres bg JOIN books b ON b.id = bg.book_id '
+        'GROUP BY bg.book_id HAVING COUNT(*) = 3'
+    ).fetchone()['book_id']
+    names = {r['name'] for r in db.execute(
+        'SELECT g.name FROM book_genres bg JOIN genres g ON g.id = bg.genre_id WHERE bg.book_id = ?', (book_id,)
+    )}
+
+    _, books = search_books(db, filters(genres=['3']), 1, 100)
+    book = next(b for b in books if b['id'] == book_id)
+    assert set(book['genres'].split(', ')) == names
+
+
+@pytest.mark.parametrize('values', [{'genres': ['x']}, {'genres': ['1', 'x']}, {'years': ['abc']}])
+def test_non_numeric_values_match_nothing(db, values):
+    assert search_books(db, filters(**values), 1, 10) == (0, [])
+
+
+def test_index_header_shows_total(client, db):
+    html = client.get('/?genres=1&genres=2&genres=3').get_data(as_text=True)
+    total, _ = search_books(db, filters(genres=['1', '2', '3']), 1, 10)
+    assert f'Найдено книг: {total}' in html
+    assert client.get('/?genres=x').get_data(as_text=True).count('Найдено книг: 0') == 1
+
+
+def test_equal_shapes_reuse_compiled_text(db):
+    first = compile_search(filter_shape(normalize_filters(filters(title='a', genres=['1', '2']))))
+    hits = compile_search.cache_info().hits
+    second = compile_search(filter_shape(normalize_filters(filters(title='b', genres=['5', '7']))))
+    assert compile_search.cache_info().hits == hits + 1
+    assert second is first